@@ -1,13 +1,30 @@
 import os
+import sys
+import asyncio
+import collections
+import contextlib
+import contextvars
+import functools
+import heapq
+import random
+import secrets
+import sqlite3
+import threading
 import logging
+import logging.handlers
+import queue
+import atexit
+import time
 import requests
 import json
 from datetime import datetime, timedelta
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, ConversationHandler
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ContextTypes, ConversationHandler
 from dotenv import load_dotenv
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from notion_client import Client
 import google_auth_oauthlib.flow
 import tempfile
@@ -27,13 +44,184 @@ import subprocess
 # Load environment variables
 load_dotenv()
 
+# Logging settings
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'text' or 'json'
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', '20'))  # Records per call site per window (0 disables)
+LOG_RATE_WINDOW = float(os.getenv('LOG_RATE_WINDOW', '10'))  # Seconds
+LOG_LOSS_REPORT_INTERVAL = 60  # Seconds between reports of suppressed/dropped records
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects."""
+    
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'logger': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+    """Drop records below WARNING from call sites that log more than `limit` times per window."""
+    
+    def __init__(self, limit, window):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.counters = {}
+        self.suppressed = 0
+    
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        window_start, count = self.counters.get(key, (record.created, 0))
+        if record.created - window_start >= self.window:
+            window_start, count = record.created, 0
+        self.counters[key] = (window_start, count + 1)
+        if count < self.limit:
+            return True
+        self.suppressed += 1
+        return False
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves formatting to the listener and drops records when the queue is full."""
+    
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record):
+        # The listener runs in this process, so the record can be passed through unformatted
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging():
+    """Route all logging through a queue so formatting and I/O happen on a background thread."""
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_WINDOW))
+    
+    root_logger = logging.getLogger()
+    root_logger.handlers = [queue_handler]
+    root_logger.setLevel(LOG_LEVEL)
+    
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener, queue_handler
+
 # Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+log_listener, log_queue_handler = setup_logging()
 logger = logging.getLogger(__name__)
 
+# Tracing and profiling settings
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.log')
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv('TRACE_BACKUP_COUNT', '5'))
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+PROFILE_MAX_SECONDS = 300
+PROFILE_INTERVAL = 0.01  # Seconds between stack samples
+# Innermost frames (file, function) of threads that are blocked rather than running
+PROFILE_WAIT_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+}
+
+trace_id_var = contextvars.ContextVar('trace_id', default=None)
+span_id_var = contextvars.ContextVar('span_id', default=None)
+trace_logger = logging.getLogger('trace')
+profiler_lock = asyncio.Lock()
+
+class SpanFormatter(logging.Formatter):
+    """Format span records (logged as dicts) as JSON lines."""
+    
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False)
+
+def setup_trace_logging():
+    """Write spans to a rotating file through their own queue listener."""
+    file_handler = logging.handlers.RotatingFileHandler(
+        TRACE_FILE,
+        maxBytes=TRACE_MAX_BYTES,
+        backupCount=TRACE_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(SpanFormatter())
+    
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    trace_logger.handlers = [queue_handler]
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+    
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener, queue_handler
+
+trace_listener, trace_queue_handler = setup_trace_logging()
+
+@contextlib.contextmanager
+def trace_span(name, **attributes):
+    """Time a block of code as a span of the current update's trace."""
+    parent_id = span_id_var.get()
+    span_id = secrets.token_hex(8)
+    token = span_id_var.set(span_id)
+    started_at = time.time()
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        span_id_var.reset(token)
+        trace_logger.info({
+            'trace_id': trace_id_var.get(),
+            'span_id': span_id,
+            'parent_id': parent_id,
+            'name': name,
+            'start': started_at,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+            'status': status,
+            **attributes
+        })
+
+def traced(name):
+    """Decorator that records each call of a function as a span."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with trace_span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
 # Notion setup
 NOTION_TOKEN = os.getenv('NOTION_TOKEN')
 NOTION_DATABASE_ID = os.getenv('NOTION_DATABASE_ID')
@@ -48,12 +236,378 @@ GOOGLE_CREDENTIALS_FILE = os.getenv('GOOGLE_CREDENTIALS_FILE')
 CALENDAR_ID = os.getenv('CALENDAR_ID')  # Get from environment variables
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+# ICS import settings (Calendar API batches accept at most 50 requests)
+ICS_IMPORT_BATCH_SIZE = min(int(os.getenv('ICS_IMPORT_BATCH_SIZE', '50')), 50)
+ICS_IMPORT_BATCH_DELAY = float(os.getenv('ICS_IMPORT_BATCH_DELAY', '1.0'))  # Seconds between batches
+ICS_IMPORT_MAX_RETRIES = int(os.getenv('ICS_IMPORT_MAX_RETRIES', '5'))
+ICS_IMPORT_PROGRESS_INTERVAL = 5  # Seconds between progress message edits
+ICS_IMPORT_YIELD_EVERY = 200  # Events parsed between yields to the event loop
+
+# Windows time zone names used by Outlook/Exchange exports, mapped to IANA zones (from CLDR)
+WINDOWS_TIMEZONES = {
+    'Dateline Standard Time': 'Etc/GMT+12',
+    'UTC-11': 'Etc/GMT+11',
+    'Aleutian Standard Time': 'America/Adak',
+    'Hawaiian Standard Time': 'Pacific/Honolulu',
+    'Marquesas Standard Time': 'Pacific/Marquesas',
+    'Alaskan Standard Time': 'America/Anchorage',
+    'UTC-09': 'Etc/GMT+9',
+    'Pacific Standard Time (Mexico)': 'America/Tijuana',
+    'UTC-08': 'Etc/GMT+8',
+    'Pacific Standard Time': 'America/Los_Angeles',
+    'US Mountain Standard Time': 'America/Phoenix',
+    'Mountain Standard Time (Mexico)': 'America/Mazatlan',
+    'Mountain Standard Time': 'America/Denver',
+    'Central America Standard Time': 'America/Guatemala',
+    'Central Standard Time': 'America/Chicago',
+    'Easter Island Standard Time': 'Pacific/Easter',
+    'Central Standard Time (Mexico)': 'America/Mexico_City',
+    'Canada Central Standard Time': 'America/Regina',
+    'SA Pacific Standard Time': 'America/Bogota',
+    'Eastern Standard Time (Mexico)': 'America/Cancun',
+    'Eastern Standard Time': 'America/New_York',
+    'Haiti Standard Time': 'America/Port-au-Prince',
+    'Cuba Standard Time': 'America/Havana',
+    'US Eastern Standard Time': 'America/Indiana/Indianapolis',
+    'Turks And Caicos Standard Time': 'America/Grand_Turk',
+    'Paraguay Standard Time': 'America/Asuncion',
+    'Atlantic Standard Time': 'America/Halifax',
+    'Venezuela Standard Time': 'America/Caracas',
+    'Central Brazilian Standard Time': 'America/Cuiaba',
+    'SA Western Standard Time': 'America/La_Paz',
+    'Pacific SA Standard Time': 'America/Santiago',
+    'Newfoundland Standard Time': 'America/St_Johns',
+    'Tocantins Standard Time': 'America/Araguaina',
+    'E. South America Standard Time': 'America/Sao_Paulo',
+    'SA Eastern Standard Time': 'America/Cayenne',
+    'Argentina Standard Time': 'America/Argentina/Buenos_Aires',
+    'Greenland Standard Time': 'America/Godthab',
+    'Montevideo Standard Time': 'America/Montevideo',
+    'Magallanes Standard Time': 'America/Punta_Arenas',
+    'Saint Pierre Standard Time': 'America/Miquelon',
+    'Bahia Standard Time': 'America/Bahia',
+    'UTC-02': 'Etc/GMT+2',
+    'Azores Standard Time': 'Atlantic/Azores',
+    'Cape Verde Standard Time': 'Atlantic/Cape_Verde',
+    'UTC': 'Etc/UTC',
+    'GMT Standard Time': 'Europe/London',
+    'Greenwich Standard Time': 'Atlantic/Reykjavik',
+    'Sao Tome Standard Time': 'Africa/Sao_Tome',
+    'Morocco Standard Time': 'Africa/Casablanca',
+    'W. Europe Standard Time': 'Europe/Berlin',
+    'Central Europe Standard Time': 'Europe/Budapest',
+    'Romance Standard Time': 'Europe/Paris',
+    'Central European Standard Time': 'Europe/Warsaw',
+    'W. Central Africa Standard Time': 'Africa/Lagos',
+    'Jordan Standard Time': 'Asia/Amman',
+    'GTB Standard Time': 'Europe/Bucharest',
+    'Middle East Standard Time': 'Asia/Beirut',
+    'Egypt Standard Time': 'Africa/Cairo',
+    'E. Europe Standard Time': 'Europe/Chisinau',
+    'Syria Standard Time': 'Asia/Damascus',
+    'West Bank Standard Time': 'Asia/Hebron',
+    'South Africa Standard Time': 'Africa/Johannesburg',
+    'FLE Standard Time': 'Europe/Kiev',
+    'Israel Standard Time': 'Asia/Jerusalem',
+    'South Sudan Standard Time': 'Africa/Juba',
+    'Kaliningrad Standard Time': 'Europe/Kaliningrad',
+    'Sudan Standard Time': 'Africa/Khartoum',
+    'Libya Standard Time': 'Africa/Tripoli',
+    'Namibia Standard Time': 'Africa/Windhoek',
+    'Arabic Standard Time': 'Asia/Baghdad',
+    'Turkey Standard Time': 'Europe/Istanbul',
+    'Arab Standard Time': 'Asia/Riyadh',
+    'Belarus Standard Time': 'Europe/Minsk',
+    'Russian Standard Time': 'Europe/Moscow',
+    'E. Africa Standard Time': 'Africa/Nairobi',
+    'Volgograd Standard Time': 'Europe/Volgograd',
+    'Iran Standard Time': 'Asia/Tehran',
+    'Arabian Standard Time': 'Asia/Dubai',
+    'Astrakhan Standard Time': 'Europe/Astrakhan',
+    'Azerbaijan Standard Time': 'Asia/Baku',
+    'Russia Time Zone 3': 'Europe/Samara',
+    'Mauritius Standard Time': 'Indian/Mauritius',
+    'Saratov Standard Time': 'Europe/Saratov',
+    'Georgian Standard Time': 'Asia/Tbilisi',
+    'Caucasus Standard Time': 'Asia/Yerevan',
+    'Afghanistan Standard Time': 'Asia/Kabul',
+    'West Asia Standard Time': 'Asia/Tashkent',
+    'Ekaterinburg Standard Time': 'Asia/Yekaterinburg',
+    'Pakistan Standard Time': 'Asia/Karachi',
+    'Qyzylorda Standard Time': 'Asia/Qyzylorda',
+    'India Standard Time': 'Asia/Kolkata',
+    'Sri Lanka Standard Time': 'Asia/Colombo',
+    'Nepal Standard Time': 'Asia/Kathmandu',
+    'Central Asia Standard Time': 'Asia/Almaty',
+    'Bangladesh Standard Time': 'Asia/Dhaka',
+    'Omsk Standard Time': 'Asia/Omsk',
+    'Myanmar Standard Time': 'Asia/Yangon',
+    'SE Asia Standard Time': 'Asia/Bangkok',
+    'Altai Standard Time': 'Asia/Barnaul',
+    'W. Mongolia Standard Time': 'Asia/Hovd',
+    'North Asia Standard Time': 'Asia/Krasnoyarsk',
+    'N. Central Asia Standard Time': 'Asia/Novosibirsk',
+    'Tomsk Standard Time': 'Asia/Tomsk',
+    'China Standard Time': 'Asia/Shanghai',
+    'North Asia East Standard Time': 'Asia/Irkutsk',
+    'Singapore Standard Time': 'Asia/Singapore',
+    'W. Australia Standard Time': 'Australia/Perth',
+    'Taipei Standard Time': 'Asia/Taipei',
+    'Ulaanbaatar Standard Time': 'Asia/Ulaanbaatar',
+    'Aus Central W. Standard Time': 'Australia/Eucla',
+    'Transbaikal Standard Time': 'Asia/Chita',
+    'Tokyo Standard Time': 'Asia/Tokyo',
+    'North Korea Standard Time': 'Asia/Pyongyang',
+    'Korea Standard Time': 'Asia/Seoul',
+    'Yakutsk Standard Time': 'Asia/Yakutsk',
+    'Cen. Australia Standard Time': 'Australia/Adelaide',
+    'AUS Central Standard Time': 'Australia/Darwin',
+    'E. Australia Standard Time': 'Australia/Brisbane',
+    'AUS Eastern Standard Time': 'Australia/Sydney',
+    'West Pacific Standard Time': 'Pacific/Port_Moresby',
+    'Tasmania Standard Time': 'Australia/Hobart',
+    'Vladivostok Standard Time': 'Asia/Vladivostok',
+    'Lord Howe Standard Time': 'Australia/Lord_Howe',
+    'Bougainville Standard Time': 'Pacific/Bougainville',
+    'Russia Time Zone 10': 'Asia/Srednekolymsk',
+    'Magadan Standard Time': 'Asia/Magadan',
+    'Norfolk Standard Time': 'Pacific/Norfolk',
+    'Sakhalin Standard Time': 'Asia/Sakhalin',
+    'Central Pacific Standard Time': 'Pacific/Guadalcanal',
+    'Russia Time Zone 11': 'Asia/Kamchatka',
+    'New Zealand Standard Time': 'Pacific/Auckland',
+    'UTC+12': 'Etc/GMT-12',
+    'Fiji Standard Time': 'Pacific/Fiji',
+    'Chatham Islands Standard Time': 'Pacific/Chatham',
+    'UTC+13': 'Etc/GMT-13',
+    'Tonga Standard Time': 'Pacific/Tongatapu',
+    'Samoa Standard Time': 'Pacific/Apia',
+    'Line Islands Standard Time': 'Pacific/Kiritimati',
+}
+
+# Maximum number of updates (from different chats) processed at the same time
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+
 # Define conversation states
 TASK_NAME, TASK_DATE, TASK_TIME, TASK_DURATION, TASK_ATTENDEES = range(5)
 EVENT_NAME, EVENT_DATE, EVENT_TIME, EVENT_DURATION, EVENT_ATTENDEES = range(5)
 
-# Store temporary data
-user_data = {}
+# Speech recognition setup
+VOSK_MODEL_PATH = os.path.join("models", "vosk-model-small-en-us-0.15")
+vosk_model = None
+vosk_model_lock = threading.Lock()
+
+# Vocabulary accepted for voice replies in wizard steps
+SPOKEN_DATES = {"today": "Today", "tomorrow": "Tomorrow", "next week": "Next Week"}
+SPOKEN_HOURS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12
+}
+SPOKEN_MINUTES = {"o'clock": 0, "fifteen": 15, "thirty": 30, "forty five": 45}
+SPOKEN_MERIDIEMS = {
+    "a m": "AM", "p m": "PM",
+    "in the morning": "AM", "in the afternoon": "PM", "in the evening": "PM"
+}
+SPOKEN_DURATIONS = {
+    "fifteen minutes": 15, "twenty minutes": 20, "thirty minutes": 30, "half an hour": 30,
+    "forty five minutes": 45, "an hour": 60, "one hour": 60, "an hour and a half": 90,
+    "ninety minutes": 90, "two hours": 120, "three hours": 180
+}
+
+# Per-user state settings
+USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', str(24 * 60 * 60)))  # Seconds of inactivity before eviction
+USER_STATE_MAX_ENTRIES = int(os.getenv('USER_STATE_MAX_ENTRIES', '10000'))  # Users plus chats kept in memory
+CONVERSATION_TIMEOUT = int(os.getenv('CONVERSATION_TIMEOUT', '600'))  # Seconds before an idle wizard is ended
+STATE_SWEEP_INTERVAL = 300  # Seconds between eviction sweeps
+
+# Keys stored in context.user_data by the task and calendar wizards
+WIZARD_KEYS = ('task_name', 'due_date', 'event_name', 'event_date', 'event_time', 'duration_minutes')
+
+class UserStateStore:
+    """Track when each user and chat was last seen so their idle state can be evicted.
+    
+    Entries are kept in least-recently-seen order, so eviction only looks at the
+    oldest entries and a sweep stops at the first one that is still fresh.
+    """
+    
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.last_seen = collections.OrderedDict()
+        self.evictions = 0
+    
+    def __len__(self):
+        return len(self.last_seen)
+    
+    def touch(self, key):
+        """Mark a ('user', id) or ('chat', id) key as active now."""
+        self.last_seen[key] = time.monotonic()
+        self.last_seen.move_to_end(key)
+    
+    def pop_expired(self):
+        """Remove and return keys that are idle past the TTL or over capacity."""
+        now = time.monotonic()
+        expired = []
+        while self.last_seen:
+            key, seen = next(iter(self.last_seen.items()))
+            if now - seen < self.ttl and len(self.last_seen) <= self.max_entries:
+                break
+            self.last_seen.popitem(last=False)
+            expired.append(key)
+        self.evictions += len(expired)
+        return expired
+
+user_state = UserStateStore(USER_STATE_TTL, USER_STATE_MAX_ENTRIES)
+
+# Local storage and reminder settings
+BOT_DB_PATH = os.getenv('BOT_DB_PATH', 'bot_data.db')
+REMINDER_LEAD_MINUTES = int(os.getenv('REMINDER_LEAD_MINUTES', '15'))
+REMINDER_BATCH_SIZE = 100  # Reminders loaded and sent per batch
+REMINDER_SEND_CONCURRENCY = 20  # Concurrent sendMessage calls while firing a batch
+REMINDER_MAX_ATTEMPTS = 10
+REMINDER_RETRY_BASE = 30  # Seconds before retrying a failed send, doubled on each attempt
+REMINDER_RETRY_MAX = 60 * 60
+
+def open_db(path):
+    """Open a SQLite connection in WAL mode for the bot's local data."""
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+class ReminderScheduler:
+    """Send Telegram reminders when they are due.
+    
+    Reminders are persisted in SQLite and only (fire_at, id) pairs are kept in an
+    in-memory heap. A single task sleeps until the earliest reminder is due and is
+    only woken early when a sooner reminder is scheduled, so idle CPU stays flat.
+    """
+    
+    def __init__(self, db_path):
+        self.db = open_db(db_path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS reminders ('
+            'id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, fire_at REAL NOT NULL, text TEXT NOT NULL, '
+            'event_start REAL)'
+        )
+        columns = {row[1] for row in self.db.execute('PRAGMA table_info(reminders)')}
+        if 'event_start' not in columns:
+            self.db.execute('ALTER TABLE reminders ADD COLUMN event_start REAL')
+        self.db.commit()
+        self.heap = []
+        self.attempts = {}  # Failed send attempts of reminders being retried
+        self.bot = None
+        self.wakeup = None
+        self.task = None
+    
+    def __len__(self):
+        return len(self.heap)
+    
+    async def start(self, bot):
+        """Load pending reminders and start the firing task."""
+        self.bot = bot
+        self.heap = [(fire_at, reminder_id) for reminder_id, fire_at in self.db.execute('SELECT id, fire_at FROM reminders')]
+        heapq.heapify(self.heap)
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+        logger.info("Reminder scheduler started with %s pending reminders", len(self.heap))
+    
+    async def stop(self):
+        """Stop the firing task. Pending reminders stay in the database."""
+        if self.task:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+    
+    def schedule(self, chat_id, fire_at, text, event_start=None):
+        """Persist a reminder and add it to the heap.
+        
+        Reminders still unsent when `event_start` passes (e.g. after downtime) are dropped.
+        """
+        cursor = self.db.execute(
+            'INSERT INTO reminders (chat_id, fire_at, text, event_start) VALUES (?, ?, ?, ?)',
+            (chat_id, fire_at, text, event_start)
+        )
+        self.db.commit()
+        entry = (fire_at, cursor.lastrowid)
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry and self.wakeup:
+            self.wakeup.set()
+    
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            timeout = max(0, self.heap[0][0] - time.time()) if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.fire_due()
+            except Exception as e:
+                logger.error("Error firing reminders: %s", e)
+    
+    async def fire_due(self):
+        """Send all reminders that are due, in batches.
+        
+        Sent reminders and ones Telegram rejects permanently are deleted; transient
+        failures (network errors, flood limits) are rescheduled with a backoff.
+        Reminders whose event has already started are deleted without being sent.
+        """
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            ids = []
+            while self.heap and self.heap[0][0] <= now and len(ids) < REMINDER_BATCH_SIZE:
+                ids.append(heapq.heappop(self.heap)[1])
+            
+            placeholders = ','.join('?' * len(ids))
+            rows = self.db.execute(
+                f'SELECT id, chat_id, text, event_start FROM reminders WHERE id IN ({placeholders})', ids
+            ).fetchall()
+            
+            finished, retries = [], []
+            # Left over from downtime; a reminder for an event that has already started is only noise
+            started = {row[0] for row in rows if row[3] is not None and row[3] <= time.time()}
+            if started:
+                logger.info("Dropping %s reminders for events that have already started", len(started))
+                for reminder_id in started:
+                    finished.append(reminder_id)
+                    self.attempts.pop(reminder_id, None)
+                rows = [row for row in rows if row[0] not in started]
+            
+            semaphore = asyncio.Semaphore(REMINDER_SEND_CONCURRENCY)
+            
+            async def send(chat_id, text):
+                async with semaphore:
+                    await self.bot.send_message(chat_id=chat_id, text=text)
+            
+            results = await asyncio.gather(*(send(chat_id, text) for _, chat_id, text, _ in rows), return_exceptions=True)
+            
+            for (reminder_id, _, _, _), result in zip(rows, results):
+                attempts = self.attempts.pop(reminder_id, 0) + 1
+                if result is None:
+                    finished.append(reminder_id)
+                elif isinstance(result, (Forbidden, BadRequest)) or attempts >= REMINDER_MAX_ATTEMPTS:
+                    logger.warning("Dropping reminder %s after %s attempts: %s", reminder_id, attempts, result)
+                    finished.append(reminder_id)
+                else:
+                    if isinstance(result, RetryAfter):
+                        delay = result.retry_after
+                    else:
+                        delay = min(REMINDER_RETRY_BASE * 2 ** (attempts - 1), REMINDER_RETRY_MAX)
+                    logger.warning("Failed to send reminder %s (attempt %s), retrying in %ss: %s", reminder_id, attempts, delay, result)
+                    self.attempts[reminder_id] = attempts
+                    retries.append((time.time() + delay, reminder_id))
+            
+            if finished:
+                self.db.execute(f'DELETE FROM reminders WHERE id IN ({",".join("?" * len(finished))})', finished)
+            if retries:
+                self.db.executemany('UPDATE reminders SET fire_at = ? WHERE id = ?', retries)
+                for entry in retries:
+                    heapq.heappush(self.heap, entry)
+            self.db.commit()
+
+reminders = ReminderScheduler(BOT_DB_PATH)
 
 # Initialize Notion client
 notion = Client(auth=NOTION_TOKEN)
@@ -71,12 +625,417 @@ def get_google_calendar_service():
         logger.error(f"Error creating Google Calendar service: {str(e)}")
         return None
 
+# Outbox settings for Notion and Calendar writes
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', '4'))  # Concurrent deliveries per upstream
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_RETRY_BASE = 5  # Seconds before the first retry, doubled on each attempt
+OUTBOX_RETRY_MAX = 60 * 60
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', '7'))  # Days finished writes are kept
+OUTBOX_PRUNE_INTERVAL = 6 * 60 * 60  # Seconds between retention sweeps
+OUTBOX_PRUNE_BATCH = 1000  # Rows deleted per statement while pruning
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = int(os.getenv('CIRCUIT_RESET_TIMEOUT', '60'))  # Seconds before probing an open circuit
+OUTBOX_PENDING_LINK = "⏳ saving..."
+OUTBOX_TARGET_NAMES = {'notion': 'Notion', 'calendar': 'Google Calendar'}
+
+class CircuitBreaker:
+    """Stop calling an upstream after repeated failures and probe it again after a cool-down."""
+    
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+    
+    def allow(self):
+        """Check whether a call may be made. In half-open state one probe is let through per cool-down."""
+        state = self.state
+        if state == 'half-open':
+            self.opened_at = time.monotonic()
+        return state != 'open'
+    
+    def retry_in(self):
+        """Seconds until the circuit lets the next call through."""
+        if self.opened_at is None:
+            return 0
+        return max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+    
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class Outbox:
+    """Durable write-behind queue for Notion and Calendar writes.
+    
+    Writes are stored in SQLite before the user is answered and delivered by one
+    background task per upstream, with retries, idempotency keys and a circuit
+    breaker. When a write finishes, the bot edits its reply to add the link.
+    """
+    
+    def __init__(self, db_path, deliverers):
+        self.db = open_db(db_path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            'id INTEGER PRIMARY KEY, idempotency_key TEXT NOT NULL UNIQUE, target TEXT NOT NULL, '
+            'payload TEXT NOT NULL, chat_id INTEGER NOT NULL, message_id INTEGER, reply_text TEXT NOT NULL, '
+            "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            'next_attempt_at REAL NOT NULL, last_error TEXT, result_url TEXT, created_at REAL NOT NULL, '
+            'trace_id TEXT, reminder TEXT)'
+        )
+        columns = {row[1] for row in self.db.execute('PRAGMA table_info(outbox)')}
+        for column in ('trace_id', 'reminder'):
+            if column not in columns:
+                self.db.execute(f'ALTER TABLE outbox ADD COLUMN {column} TEXT')
+        self.db.execute('CREATE INDEX IF NOT EXISTS outbox_due ON outbox (target, status, next_attempt_at)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, created_at)')
+        self.db.commit()
+        self.deliverers = deliverers
+        self.breakers = {target: CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT) for target in deliverers}
+        self.wakeups = {}
+        self.tasks = []
+        self.awaiting_reply = set()  # Rows whose acknowledgement is still being sent
+        self.bot = None
+    
+    async def start(self, bot):
+        """Start one delivery task per upstream. Pending writes from earlier runs are resumed."""
+        self.bot = bot
+        for target in self.deliverers:
+            self.wakeups[target] = asyncio.Event()
+            self.tasks.append(asyncio.create_task(self.run(target)))
+    
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    
+    def counts(self):
+        """Return the number of pending and failed outbox rows."""
+        return dict(self.db.execute(
+            "SELECT status, COUNT(*) FROM outbox WHERE status IN ('pending', 'failed') GROUP BY status"
+        ).fetchall())
+    
+    def prune_batch(self, cutoff):
+        """Delete one batch of finished writes submitted before `cutoff`. Returns the number deleted."""
+        cursor = self.db.execute(
+            "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox WHERE status IN ('done', 'failed') "
+            "AND created_at < ? LIMIT ?)",
+            (cutoff, OUTBOX_PRUNE_BATCH)
+        )
+        self.db.commit()
+        return cursor.rowcount
+    
+    async def submit(self, update, target, key, payload, reply_text, reply_markup=None, reminder=None):
+        """Record a write, acknowledge it to the user and hand it to the delivery task.
+        
+        `reply_text` must contain OUTBOX_PENDING_LINK, which is replaced by the link once delivered.
+        `reminder` is an optional (title, start) pair; the reminder is only scheduled once the
+        write has been delivered.
+        """
+        if reminder is not None:
+            title, start = reminder
+            reminder = json.dumps({'title': title, 'start': start.isoformat()})
+        cursor = self.db.execute(
+            'INSERT INTO outbox (idempotency_key, target, payload, chat_id, reply_text, next_attempt_at, created_at, trace_id, reminder) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, target, json.dumps(payload), update.effective_chat.id, reply_text, time.time(), time.time(),
+             trace_id_var.get(), reminder)
+        )
+        self.db.commit()
+        outbox_id = cursor.lastrowid
+        
+        # The write is recorded and will be delivered, so a failed reply must not be reported
+        # as a failed write; notify() then sends the outcome as a new message instead
+        self.awaiting_reply.add(outbox_id)
+        try:
+            reply = await update.message.reply_text(reply_text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.warning("Could not acknowledge outbox write %s: %s", key, e)
+        else:
+            self.db.execute('UPDATE outbox SET message_id = ? WHERE id = ?', (reply.message_id, outbox_id))
+            self.db.commit()
+        finally:
+            self.awaiting_reply.discard(outbox_id)
+        
+        # The write may have been delivered while the reply was being sent
+        status = self.db.execute('SELECT status FROM outbox WHERE id = ?', (outbox_id,)).fetchone()[0]
+        if status != 'pending':
+            await self.notify(outbox_id)
+        if target in self.wakeups:
+            self.wakeups[target].set()
+    
+    async def run(self, target):
+        wakeup = self.wakeups[target]
+        breaker = self.breakers[target]
+        while True:
+            wakeup.clear()
+            next_due = self.db.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE target = ? AND status = 'pending'", (target,)
+            ).fetchone()[0]
+            timeout = None if next_due is None else max(next_due - time.time(), breaker.retry_in())
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            rows = self.db.execute(
+                "SELECT id, idempotency_key, payload, attempts, trace_id FROM outbox "
+                "WHERE target = ? AND status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (target, time.time(), OUTBOX_CONCURRENCY)
+            ).fetchall()
+            deliveries = []
+            for row in rows:
+                if not breaker.allow():
+                    break
+                deliveries.append(self.deliver(target, *row))
+            try:
+                await asyncio.gather(*deliveries)
+            except Exception as e:
+                logger.error("Error delivering %s outbox writes: %s", target, e)
+    
+    async def deliver(self, target, outbox_id, key, payload, attempts, trace_id):
+        """Deliver one write and record the outcome."""
+        breaker = self.breakers[target]
+        # Runs in its own task, so this attaches the span to the submitting update's trace
+        trace_id_var.set(trace_id)
+        try:
+            with trace_span(f'outbox.deliver.{target}', attempt=attempts + 1):
+                url = await asyncio.to_thread(self.deliverers[target], key, json.loads(payload), attempts)
+        except Exception as e:
+            attempts += 1
+            retryable = is_retryable_error(e)
+            if retryable:
+                # Client errors mean the upstream is up, so only these count towards the circuit
+                breaker.record_failure()
+            if retryable and attempts < OUTBOX_MAX_ATTEMPTS:
+                delay = min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX) * random.uniform(0.5, 1.0)
+                logger.warning("Outbox %s write %s failed (attempt %s), retrying in %.0fs: %s", target, key, attempts, delay, e)
+                self.db.execute(
+                    'UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                    (attempts, time.time() + delay, str(e), outbox_id)
+                )
+                self.db.commit()
+                return
+            logger.error("Outbox %s write %s failed permanently: %s", target, key, e)
+            self.db.execute(
+                "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, str(e), outbox_id)
+            )
+            self.db.commit()
+        else:
+            breaker.record_success()
+            logger.info("Outbox %s write %s delivered: %s", target, key, url)
+            self.db.execute(
+                "UPDATE outbox SET status = 'done', attempts = ?, result_url = ? WHERE id = ?",
+                (attempts + 1, url, outbox_id)
+            )
+            self.db.commit()
+            self.schedule_reminder(outbox_id)
+        await self.notify(outbox_id)
+    
+    def schedule_reminder(self, outbox_id):
+        """Schedule the reminder of a delivered write, clearing it if the event has already started."""
+        chat_id, reminder = self.db.execute(
+            'SELECT chat_id, reminder FROM outbox WHERE id = ?', (outbox_id,)
+        ).fetchone()
+        if reminder is None:
+            return
+        reminder = json.loads(reminder)
+        if not schedule_event_reminder(chat_id, reminder['title'], datetime.fromisoformat(reminder['start'])):
+            self.db.execute('UPDATE outbox SET reminder = NULL WHERE id = ?', (outbox_id,))
+            self.db.commit()
+    
+    async def notify(self, outbox_id):
+        """Edit the acknowledgement message with the final link or error, or send it if there is none."""
+        row = self.db.execute(
+            'SELECT target, chat_id, message_id, reply_text, status, result_url, last_error, reminder FROM outbox WHERE id = ?',
+            (outbox_id,)
+        ).fetchone()
+        target, chat_id, message_id, reply_text, status, result_url, last_error, reminder = row
+        if outbox_id in self.awaiting_reply:
+            return  # submit() notifies once the reply exists
+        
+        before, _, after = reply_text.rpartition(OUTBOX_PENDING_LINK)
+        if status == 'done':
+            reminder_message = ""
+            if reminder is not None:
+                reminder_message = f"\n⏰ I'll remind you {REMINDER_LEAD_MINUTES} minutes before it starts."
+            text = f"{before}{result_url or 'No link available'}{reminder_message}{after}"
+        else:
+            text = f"{before}❌ could not save to {OUTBOX_TARGET_NAMES[target]} ({last_error}){after}"
+        try:
+            if message_id is None:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+            else:
+                await self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+        except Exception as e:
+            logger.warning("Could not update outbox message for write %s: %s", outbox_id, e)
+
+def new_idempotency_key():
+    """Return a key usable both as a Calendar event ID (base32hex) and a Notion reference."""
+    return secrets.token_hex(16)
+
+def is_retryable_error(error):
+    """Check whether a failed upstream write may succeed if retried."""
+    if isinstance(error, HttpError):
+        status = error.resp.status
+    else:
+        status = getattr(error, 'status', None)
+    if status is None:
+        return True  # Network errors and timeouts
+    return status == 429 or status >= 500 or is_rate_limit_error(error)
+
+def deliver_notion_page(key, payload, attempts):
+    """Create a Notion page, skipping it if an earlier attempt already created it."""
+    if attempts:
+        existing = notion.databases.query(
+            database_id=NOTION_DATABASE_ID,
+            filter={"property": "notes", "rich_text": {"contains": key}},
+            page_size=1
+        )
+        if existing.get('results'):
+            return existing['results'][0].get('url')
+    return notion.pages.create(**payload).get('url')
+
+def deliver_calendar_event(key, payload, attempts):
+    """Insert a Calendar event whose ID is the idempotency key."""
+    service = get_google_calendar_service()
+    if not service:
+        raise RuntimeError("Google Calendar service is not available")
+    try:
+        return service.events().insert(calendarId=CALENDAR_ID, body=payload).execute().get('htmlLink')
+    except HttpError as e:
+        if e.resp.status == 409:
+            # Already created by an earlier attempt
+            return service.events().get(calendarId=CALENDAR_ID, eventId=key).execute().get('htmlLink')
+        raise
+
+outbox = Outbox(BOT_DB_PATH, {'notion': deliver_notion_page, 'calendar': deliver_calendar_event})
+
+# Transcript store settings
+TRANSCRIPT_RETENTION_DAYS = int(os.getenv('TRANSCRIPT_RETENTION_DAYS', '90'))
+TRANSCRIPT_PRUNE_INTERVAL = 6 * 60 * 60  # Seconds between retention sweeps
+TRANSCRIPT_PRUNE_BATCH = 1000  # Rows deleted per statement while pruning
+SEARCH_PAGE_SIZE = 5
+SEARCH_RETENTION = 24 * 60 * 60  # Seconds a search's "Older" button keeps working
+
+class TranscriptStore:
+    """Voice note transcripts with an FTS5 full-text index.
+    
+    The index uses the transcripts table as external content (kept in sync by
+    triggers), so text is stored once. Each row is also indexed under a per-chat
+    tag, so a search only intersects posting lists of the asking chat.
+    """
+    
+    def __init__(self, db_path):
+        self.db = open_db(db_path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS transcripts (
+                id INTEGER PRIMARY KEY,
+                chat_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                duration INTEGER,
+                text TEXT NOT NULL,
+                event TEXT,
+                chat_tag TEXT GENERATED ALWAYS AS ('c' || replace(chat_id, '-', 'n')) VIRTUAL
+            );
+            CREATE INDEX IF NOT EXISTS transcripts_created ON transcripts (created_at);
+            CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+                text, chat_tag, content='transcripts', content_rowid='id'
+            );
+            CREATE TRIGGER IF NOT EXISTS transcripts_insert AFTER INSERT ON transcripts BEGIN
+                INSERT INTO transcripts_fts (rowid, text, chat_tag) VALUES (new.id, new.text, new.chat_tag);
+            END;
+            CREATE TRIGGER IF NOT EXISTS transcripts_delete AFTER DELETE ON transcripts BEGIN
+                INSERT INTO transcripts_fts (transcripts_fts, rowid, text, chat_tag)
+                VALUES ('delete', old.id, old.text, old.chat_tag);
+            END;
+            CREATE TABLE IF NOT EXISTS searches (
+                id INTEGER PRIMARY KEY,
+                chat_id INTEGER NOT NULL,
+                query TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+        ''')
+    
+    def add(self, chat_id, duration, text, event_details):
+        """Store a transcript and the event parsed from it."""
+        self.db.execute(
+            'INSERT INTO transcripts (chat_id, created_at, duration, text, event) VALUES (?, ?, ?, ?, ?)',
+            (chat_id, time.time(), duration, text, json.dumps(event_details, default=str) if event_details else None)
+        )
+        self.db.commit()
+    
+    def search(self, chat_id, query, before_id=None, limit=SEARCH_PAGE_SIZE):
+        """Return (id, created_at, duration, snippet) of a chat's newest matches older than `before_id`."""
+        terms = ' '.join('"' + term.replace('"', '""') + '"' for term in query.split())
+        if not terms:
+            return []
+        chat_tag = 'c' + str(chat_id).replace('-', 'n')
+        return self.db.execute(
+            "SELECT t.id, t.created_at, t.duration, snippet(transcripts_fts, 0, '«', '»', '…', 12) "
+            "FROM transcripts_fts JOIN transcripts t ON t.id = transcripts_fts.rowid "
+            "WHERE transcripts_fts MATCH ? AND transcripts_fts.rowid < ? "
+            "ORDER BY transcripts_fts.rowid DESC LIMIT ?",
+            # Terms are restricted to the text column so they can't match a chat tag
+            (f'chat_tag:"{chat_tag}" AND text:({terms})', before_id or sys.maxsize, limit)
+        ).fetchall()
+    
+    def save_search(self, chat_id, query):
+        """Remember a search so its result pages can be fetched later. Returns the search ID."""
+        cursor = self.db.execute(
+            'INSERT INTO searches (chat_id, query, created_at) VALUES (?, ?, ?)', (chat_id, query, time.time())
+        )
+        self.db.commit()
+        return cursor.lastrowid
+    
+    def get_search(self, chat_id, search_id):
+        """Return the query of a chat's saved search, or None if it has expired."""
+        row = self.db.execute(
+            'SELECT query FROM searches WHERE id = ? AND chat_id = ?', (search_id, chat_id)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def prune_searches(self, cutoff):
+        """Delete saved searches older than `cutoff`."""
+        self.db.execute('DELETE FROM searches WHERE created_at < ?', (cutoff,))
+        self.db.commit()
+    
+    def prune_batch(self, cutoff):
+        """Delete one batch of transcripts older than `cutoff`. Returns the number deleted."""
+        cursor = self.db.execute(
+            'DELETE FROM transcripts WHERE id IN (SELECT id FROM transcripts WHERE created_at < ? LIMIT ?)',
+            (cutoff, TRANSCRIPT_PRUNE_BATCH)
+        )
+        self.db.commit()
+        return cursor.rowcount
+
+transcripts = TranscriptStore(BOT_DB_PATH)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         '👋 Hello! I am your Assistant Bot.\n\n'
         'I can help you with:\n'
         '• Creating tasks in Notion (/task)\n'
         '• Creating calendar events (/calendar)\n'
+        '• Importing .ics calendar files (just send the file)\n'
         '• Managing your tasks and events\n'
         '• Responding to messages\n\n'
         'Try: /task Add meeting notes\n'
@@ -91,9 +1050,37 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         '/help - Show this message\n'
         '/task - Create a task\n'
         '/calendar - Create a calendar event\n'
+        '/cancel - Cancel the current task or event creation\n'
+        '/search - Search your transcribed voice notes\n'
         '/status - Check the status of integrations\n'
+        '\nSend an .ics file to import its events into your calendar.\n'
+        'While creating a task or event, you can answer the date, time and duration steps with a voice message.\n'
     )
 
+def clear_wizard_state(user_data):
+    """Remove leftover wizard keys from a user's data."""
+    for key in WIZARD_KEYS:
+        user_data.pop(key, None)
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancel the current task or calendar event conversation."""
+    clear_wizard_state(context.user_data)
+    await update.message.reply_text(
+        "Cancelled. Start again any time with /task or /calendar.",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    return ConversationHandler.END
+
+async def conversation_timeout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Clean up after a task or calendar event conversation was abandoned."""
+    clear_wizard_state(context.user_data)
+    if update.effective_chat:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="⌛ This conversation timed out. Start again with /task or /calendar.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+
 # Task creation conversation handlers
 async def task_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the task creation conversation."""
@@ -119,9 +1106,10 @@ async def task_name_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return TASK_DATE
 
-async def task_date_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def task_date_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, date_text=None):
     """Handle the task date input."""
-    date_text = update.message.text
+    if date_text is None:
+        date_text = update.message.text
     today = datetime.now()
     
     if date_text == "Today":
@@ -186,9 +1174,10 @@ async def task_time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return TASK_TIME
 
-async def task_duration_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def task_duration_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, duration_text=None):
     """Handle the task duration input."""
-    duration_text = update.message.text
+    if duration_text is None:
+        duration_text = update.message.text
     
     # Convert duration text to minutes
     if duration_text == "15 minutes":
@@ -240,8 +1229,10 @@ async def task_attendees_handler(update: Update, context: ContextTypes.DEFAULT_T
     if attendees_text.lower() != 'skip':
         attendees = [email.strip() for email in attendees_text.split(',')]
     
-    # Create the task
+    # Record the task; it is created in Notion in the background
     try:
+        key = new_idempotency_key()
+        
         # Create task with correct schema
         new_page = {
             "parent": {"database_id": NOTION_DATABASE_ID},
@@ -265,25 +1256,25 @@ async def task_attendees_handler(update: Update, context: ContextTypes.DEFAULT_T
                     }
                 },
                 "notes": {
-                    "rich_text": [{"text": {"content": "Created via Telegram bot"}}]
+                    "rich_text": [{"text": {"content": f"Created via Telegram bot (ref {key})"}}]
                 }
             }
         }
         
-        # Create the page
-        response = notion.pages.create(**new_page)
-        page_url = response.get('url', 'No link available')
-        
-        await update.message.reply_text(
-            f"✅ Task created successfully!\n\n"
+        await outbox.submit(
+            update,
+            'notion',
+            key,
+            new_page,
+            f"✅ Task saved!\n\n"
             f"📝 Task: {task_name}\n"
             f"📅 Due: {due_date}\n"
             f"🕒 Time: {event_start.strftime('%Y-%m-%d %H:%M')}\n"
             f"⏱ Duration: {duration_minutes} minutes\n"
-            f"🔗 View it here: {page_url}",
+            f"🔗 View it here: {OUTBOX_PENDING_LINK}",
             reply_markup=ReplyKeyboardRemove()
         )
-        logger.info(f"Notion task created: {page_url}")
+        logger.info("Notion task queued: %s", key)
         
     except Exception as e:
         logger.error(f"Error creating Notion task: {str(e)}")
@@ -292,6 +1283,7 @@ async def task_attendees_handler(update: Update, context: ContextTypes.DEFAULT_T
             reply_markup=ReplyKeyboardRemove()
         )
     
+    clear_wizard_state(context.user_data)
     return ConversationHandler.END
 
 # Calendar event creation conversation handlers
@@ -319,9 +1311,10 @@ async def event_name_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return EVENT_DATE
 
-async def event_date_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def event_date_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, date_text=None):
     """Handle the event date input."""
-    date_text = update.message.text
+    if date_text is None:
+        date_text = update.message.text
     today = datetime.now()
     
     if date_text == "Today":
@@ -357,9 +1350,10 @@ async def event_date_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return EVENT_TIME
 
-async def event_time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def event_time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, time_text=None):
     """Handle the event time input."""
-    time_text = update.message.text
+    if time_text is None:
+        time_text = update.message.text
     
     if time_text == "Custom Time":
         await update.message.reply_text(
@@ -389,9 +1383,10 @@ async def event_time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return EVENT_TIME
 
-async def event_duration_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def event_duration_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, duration_text=None):
     """Handle the event duration input."""
-    duration_text = update.message.text
+    if duration_text is None:
+        duration_text = update.message.text
     
     # Convert duration text to minutes
     if duration_text == "15 minutes":
@@ -443,10 +1438,11 @@ async def event_attendees_handler(update: Update, context: ContextTypes.DEFAULT_
     if attendees_text.lower() != 'skip':
         attendees = [email.strip() for email in attendees_text.split(',')]
     
-    # Create the calendar event
+    # Record the calendar event; it is created in Google Calendar in the background
     try:
-        service = get_google_calendar_service()
+        key = new_idempotency_key()
         event = {
+            'id': key,
             'summary': event_name,
             'description': 'Event created via Telegram bot',
             'start': {
@@ -462,11 +1458,6 @@ async def event_attendees_handler(update: Update, context: ContextTypes.DEFAULT_
         
         # We're not adding attendees to the event at all to avoid the 403 error
         
-        event = service.events().insert(
-            calendarId=CALENDAR_ID,
-            body=event
-        ).execute()
-        
         # Create a message about attendees
         attendee_message = ""
         if attendees:
@@ -475,15 +1466,20 @@ async def event_attendees_handler(update: Update, context: ContextTypes.DEFAULT_
                 f"⚠️ Due to service account limitations, you'll need to manually share the event link with these attendees."
             )
         
-        await update.message.reply_text(
-            f"✅ Event created successfully!\n\n"
+        await outbox.submit(
+            update,
+            'calendar',
+            key,
+            event,
+            f"✅ Event saved!\n\n"
             f"📅 Event: {event_name}\n"
             f"🕒 Time: {event_start.strftime('%Y-%m-%d %H:%M')}\n"
             f"⏱ Duration: {duration_minutes} minutes\n"
-            f"🔗 Event link: {event.get('htmlLink')}{attendee_message}",
-            reply_markup=ReplyKeyboardRemove()
+            f"🔗 Event link: {OUTBOX_PENDING_LINK}{attendee_message}",
+            reply_markup=ReplyKeyboardRemove(),
+            reminder=(event_name, event_start)
         )
-        logger.info(f"Calendar event created: {event.get('htmlLink')}")
+        logger.info("Calendar event queued: %s", key)
     except Exception as e:
         logger.error(f"Error creating calendar event: {str(e)}")
         await update.message.reply_text(
@@ -491,6 +1487,7 @@ async def event_attendees_handler(update: Update, context: ContextTypes.DEFAULT_
             reply_markup=ReplyKeyboardRemove()
         )
     
+    clear_wizard_state(context.user_data)
     return ConversationHandler.END
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -515,7 +1512,8 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if NOTION_TOKEN and NOTION_DATABASE_ID:
         try:
             url = f"https://api.notion.com/v1/databases/{NOTION_DATABASE_ID}"
-            response = requests.get(url, headers=NOTION_HEADERS)
+            with trace_span('notion.databases.retrieve'):
+                response = await asyncio.to_thread(requests.get, url, headers=NOTION_HEADERS)
             if response.status_code == 200:
                 status_message += "✅ Notion: Connected\n"
             else:
@@ -530,13 +1528,31 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         service = get_google_calendar_service()
         if service:
             # Try to list calendars as a test
-            calendar_list = service.calendarList().list().execute()
+            with trace_span('calendar.calendarList.list'):
+                calendar_list = await asyncio.to_thread(service.calendarList().list().execute)
             status_message += "✅ Google Calendar: Connected\n"
         else:
             status_message += "❌ Google Calendar: Failed to connect\n"
     except Exception as e:
         status_message += f"❌ Google Calendar: Error ({str(e)})\n"
     
+    # Background writes waiting for Notion or Google Calendar
+    outbox_counts = outbox.counts()
+    status_message += (
+        f"\n📤 Outbox: {outbox_counts.get('pending', 0)} pending, {outbox_counts.get('failed', 0)} failed\n"
+        f"⚡ Circuits: " + ", ".join(
+            f"{OUTBOX_TARGET_NAMES[target]} {breaker.state}" for target, breaker in outbox.breakers.items()
+        ) + "\n"
+    )
+    
+    # Memory used by per-user and per-chat state
+    application = context.application
+    state_bytes = estimate_size(dict(application.user_data)) + estimate_size(dict(application.chat_data))
+    status_message += (
+        f"\n🧠 State: {len(application.user_data)} users, {len(application.chat_data)} chats, "
+        f"~{state_bytes / 1024:.1f} KB, {user_state.evictions} evicted\n"
+    )
+    
     await update.message.reply_text(status_message)
 
 # Voice note processing functions
@@ -546,6 +1562,7 @@ async def download_voice_note(file_id, context):
     file_content = await file.download_as_bytearray()
     return file_content
 
+@traced('convert_audio_to_wav')
 async def convert_audio_to_wav(audio_data):
     """Convert audio data to WAV format using ffmpeg"""
     with tempfile.NamedTemporaryFile(suffix='.ogg', delete=False) as input_file:
@@ -556,7 +1573,7 @@ async def convert_audio_to_wav(audio_data):
 
     try:
         # Convert audio using ffmpeg
-        subprocess.run([
+        await asyncio.to_thread(subprocess.run, [
             'ffmpeg',
             '-i', input_path,
             '-acodec', 'pcm_s16le',
@@ -574,29 +1591,22 @@ async def convert_audio_to_wav(audio_data):
 
     return output_path
 
-async def transcribe_voice_note(audio_data):
-    """Transcribe voice note using Vosk."""
-    try:
-        # Convert audio to WAV format
-        wav_path = await convert_audio_to_wav(audio_data)
-        
-        # Check if model exists, if not, return an error message
-        model_path = os.path.join("models", "vosk-model-small-en-us-0.15")
-        if not os.path.exists(model_path):
-            logger.error(f"Vosk model not found at {model_path}")
-            return "Error: Speech recognition model not available. Please contact the administrator."
-        
-        # Open the WAV file
-        wf = wave.open(wav_path, "rb")
-        
-        # Create recognizer with timeout
-        try:
-            model = Model(model_path)
-            rec = KaldiRecognizer(model, wf.getframerate())
+def get_vosk_model():
+    """Load the Vosk model once and reuse it for every recognition."""
+    global vosk_model
+    with vosk_model_lock:
+        if vosk_model is None:
+            vosk_model = Model(VOSK_MODEL_PATH)
+        return vosk_model
+
+def decode_wav(wav_path, grammar=None):
+    """Run Vosk over a WAV file, optionally restricted to a list of grammar phrases."""
+    with wave.open(wav_path, "rb") as wf:
+        if grammar is None:
+            rec = KaldiRecognizer(get_vosk_model(), wf.getframerate())
             rec.SetWords(True)
-        except Exception as e:
-            logger.error(f"Error initializing Vosk model: {str(e)}")
-            return f"Error initializing speech recognition: {str(e)}"
+        else:
+            rec = KaldiRecognizer(get_vosk_model(), wf.getframerate(), json.dumps(grammar + ["[unk]"]))
         
         # Process audio
         results = []
@@ -611,19 +1621,115 @@ async def transcribe_voice_note(audio_data):
         # Get final result
         part = json.loads(rec.FinalResult())
         results.append(part.get("text", ""))
+    
+    # Combine all results
+    text = " ".join(filter(None, results))
+    return text.replace("[unk]", "").strip()
+
+@traced('transcribe_voice_note')
+async def transcribe_voice_note(audio_data):
+    """Transcribe voice note using Vosk."""
+    try:
+        # Check if model exists, if not, return an error message
+        if not os.path.exists(VOSK_MODEL_PATH):
+            logger.error("Vosk model not found at %s", VOSK_MODEL_PATH)
+            return "Error: Speech recognition model not available. Please contact the administrator."
         
-        # Clean up
-        wf.close()
-        os.unlink(wav_path)
+        # Convert audio to WAV format
+        wav_path = await convert_audio_to_wav(audio_data)
         
-        # Combine all results
-        text = " ".join(filter(None, results))
-        return text.strip()
+        try:
+            return await asyncio.to_thread(decode_wav, wav_path)
+        finally:
+            os.unlink(wav_path)
         
     except Exception as e:
         logger.error(f"Error transcribing voice note: {str(e)}")
         return f"Error transcribing voice note: {str(e)}"
 
+@traced('recognize_with_grammar')
+async def recognize_with_grammar(audio_data, grammar):
+    """Recognize a short voice reply using only the phrases of a step grammar."""
+    wav_path = await convert_audio_to_wav(audio_data)
+    try:
+        return await asyncio.to_thread(decode_wav, wav_path, grammar)
+    finally:
+        os.unlink(wav_path)
+
+def parse_spoken_date(text):
+    """Map a recognized date phrase to the text the date steps expect."""
+    return SPOKEN_DATES.get(text)
+
+def parse_spoken_time(text):
+    """Map a recognized time phrase (e.g. "ten thirty p m") to "HH:MM AM/PM"."""
+    if text in ("noon", "midday"):
+        return "12:00 PM"
+    
+    meridiem = None
+    for phrase, value in SPOKEN_MERIDIEMS.items():
+        if text.endswith(" " + phrase):
+            meridiem = value
+            text = text[:-len(phrase) - 1]
+            break
+    
+    hour_word, _, minute_words = text.partition(" ")
+    if hour_word not in SPOKEN_HOURS or (minute_words and minute_words not in SPOKEN_MINUTES):
+        return None
+    hour = SPOKEN_HOURS[hour_word]
+    minute = SPOKEN_MINUTES.get(minute_words, 0)
+    if meridiem is None:
+        # Without "a m"/"p m", assume working hours
+        meridiem = "AM" if 8 <= hour <= 11 else "PM"
+    return f"{hour}:{minute:02d} {meridiem}"
+
+def parse_spoken_duration(text):
+    """Map a recognized duration phrase to a number of minutes."""
+    minutes = SPOKEN_DURATIONS.get(text)
+    return str(minutes) if minutes is not None else None
+
+def build_time_grammar():
+    """List every time phrase the time steps understand."""
+    phrases = ["noon", "midday"]
+    for hour_word in SPOKEN_HOURS:
+        for minute_words in [""] + list(SPOKEN_MINUTES):
+            for meridiem in [""] + list(SPOKEN_MERIDIEMS):
+                phrases.append(" ".join(filter(None, [hour_word, minute_words, meridiem])))
+    return phrases
+
+# Grammar phrases and parsers for each voice-enabled wizard step
+VOICE_GRAMMARS = {
+    'date': (list(SPOKEN_DATES), parse_spoken_date),
+    'time': (build_time_grammar(), parse_spoken_time),
+    'duration': (list(SPOKEN_DURATIONS), parse_spoken_duration),
+}
+
+def voice_step_handler(grammar_name, text_handler, state):
+    """Build a handler that answers a wizard step by voice using the step's grammar."""
+    grammar, parse = VOICE_GRAMMARS[grammar_name]
+    
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            file = await context.bot.get_file(update.message.voice.file_id)
+            audio_data = await file.download_as_bytearray()
+            spoken_text = await recognize_with_grammar(audio_data, grammar)
+        except Exception as e:
+            logger.error("Error recognizing voice reply: %s", e)
+            await update.message.reply_text("Sorry, I couldn't process your voice reply. Please type your answer instead.")
+            return state
+        
+        text = parse(spoken_text)
+        if text is None:
+            await update.message.reply_text(
+                f"Sorry, I didn't catch that (heard: \"{spoken_text or '...'}\"). "
+                f"Please try again or type your answer."
+            )
+            return state
+        
+        return await text_handler(update, context, text)
+    
+    return traced(f'voice_step.{grammar_name}')(handler)
+
+@traced('parse_event_details')
 def parse_event_details(text):
     """Parse event details from transcribed text using NLTK and regex."""
     # Tokenize and tag parts of speech
@@ -681,11 +1787,15 @@ def parse_event_details(text):
     
     return event_details
 
+@traced('process_text_message')
 async def process_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
-    """Process text from voice notes or direct messages."""
+    """Process text from voice notes or direct messages.
+    
+    Returns the parsed event details, or None if the text could not be processed.
+    """
     try:
         # Log the text
-        logger.info(f"Processing text: {text}")
+        logger.info("Processing text: %s", text)
         
         # Parse event details
         event_details = parse_event_details(text)
@@ -695,18 +1805,19 @@ async def process_text_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 "I couldn't determine when the event should be scheduled.\n"
                 "Please use /task or /calendar to create an event with specific date and time."
             )
-            return
+            return event_details
         
         if not event_details['title']:
             await update.message.reply_text(
                 "I couldn't determine what the event is about.\n"
                 "Please use /task or /calendar to create an event with a specific title."
             )
-            return
+            return event_details
         
-        # Create calendar event
-        service = get_google_calendar_service()
+        # Record the calendar event; it is created in Google Calendar in the background
+        key = new_idempotency_key()
         event = {
+            'id': key,
             'summary': event_details['title'],
             'description': 'Event created via voice note',
             'start': {
@@ -723,24 +1834,24 @@ async def process_text_message(update: Update, context: ContextTypes.DEFAULT_TYP
         if event_details['attendees']:
             event['attendees'] = [{'email': email} for email in event_details['attendees']]
         
-        # Insert event
-        event = service.events().insert(
-            calendarId=CALENDAR_ID,
-            body=event
-        ).execute()
-        
         # Create response message
         attendee_message = ""
         if event_details['attendees']:
             attendee_message = f"\n👥 Attendees: {', '.join(event_details['attendees'])}"
         
-        await update.message.reply_text(
-            f"✅ Event created successfully!\n\n"
+        await outbox.submit(
+            update,
+            'calendar',
+            key,
+            event,
+            f"✅ Event saved!\n\n"
             f"📅 Event: {event_details['title']}\n"
             f"🕒 Time: {event_details['datetime'].strftime('%Y-%m-%d %H:%M')}\n"
             f"⏱ Duration: {event_details['duration']} minutes{attendee_message}\n"
-            f"🔗 Event link: {event.get('htmlLink')}"
+            f"🔗 Event link: {OUTBOX_PENDING_LINK}",
+            reminder=(event_details['title'], event_details['datetime'])
         )
+        return event_details
         
     except Exception as e:
         logger.error(f"Error processing text message: {str(e)}")
@@ -748,6 +1859,7 @@ async def process_text_message(update: Update, context: ContextTypes.DEFAULT_TYP
             "Sorry, I couldn't process your request. Please try using /task or /calendar commands instead."
         )
 
+@traced('handle_voice_note')
 async def handle_voice_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle voice notes by transcribing them and processing the text."""
     try:
@@ -771,7 +1883,12 @@ async def handle_voice_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             
             # Process the transcribed text
-            await process_text_message(update, context, transcribed_text)
+            event_details = await process_text_message(update, context, transcribed_text)
+            
+            # Keep the transcript searchable
+            if transcribed_text:
+                with trace_span('transcripts.add'):
+                    transcripts.add(update.effective_chat.id, voice.duration, transcribed_text, event_details)
             
             # Delete the processing message
             await processing_message.delete()
@@ -784,6 +1901,747 @@ async def handle_voice_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in handle_voice_note: {str(e)}")
         await update.message.reply_text("Sorry, I couldn't process your voice note. Please try typing your request instead.")
 
+# ICS import functions
+ICS_DURATION_PATTERN = re.compile(
+    r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$'
+)
+
+def iter_ics_lines(path):
+    """Yield unfolded content lines from an ICS file without reading it all into memory."""
+    pending = None
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as ics_file:
+        for raw_line in ics_file:
+            line = raw_line.rstrip('\r\n')
+            if line[:1] in (' ', '\t'):
+                # Folded continuation of the previous line (RFC 5545 section 3.1)
+                if pending is not None:
+                    pending += line[1:]
+                continue
+            if pending:
+                yield pending
+            pending = line
+    if pending:
+        yield pending
+
+def parse_ics_property(line):
+    """Split an ICS content line into (name, params, value)."""
+    in_quotes = False
+    for index, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ':' and not in_quotes:
+            head, value = line[:index], line[index + 1:]
+            break
+    else:
+        return None, {}, ''
+    
+    name, *raw_params = head.split(';')
+    params = {}
+    for raw_param in raw_params:
+        key, _, param_value = raw_param.partition('=')
+        params[key.upper()] = param_value.strip('"')
+    return name.upper(), params, value
+
+def iter_ics_events(path, timezones):
+    """Yield VEVENT components one at a time as dicts of name -> (params, value).
+    
+    VTIMEZONE components that name their IANA zone (X-LIC-LOCATION) are added to
+    `timezones` as they are read; exporters write them before the events using them.
+    """
+    event = None
+    vtimezone = None
+    nested = 0
+    for line in iter_ics_lines(path):
+        name, params, value = parse_ics_property(line)
+        if name is None:
+            continue
+        
+        if name == 'BEGIN':
+            if value.upper() == 'VEVENT' and event is None and vtimezone is None:
+                event = {'RECURRENCE': []}
+            elif value.upper() == 'VTIMEZONE' and event is None and vtimezone is None:
+                vtimezone = {}
+            elif event is not None or vtimezone is not None:
+                nested += 1  # e.g. VALARM inside VEVENT, STANDARD inside VTIMEZONE
+            continue
+        if name == 'END':
+            if (event is not None or vtimezone is not None) and nested:
+                nested -= 1
+            elif event is not None and value.upper() == 'VEVENT':
+                yield event
+                event = None
+            elif vtimezone is not None and value.upper() == 'VTIMEZONE':
+                location = resolve_ics_timezone(vtimezone.get('X-LIC-LOCATION', ''), timezones)
+                if 'TZID' in vtimezone and location:
+                    timezones[vtimezone['TZID']] = location
+                vtimezone = None
+            continue
+        
+        if vtimezone is not None:
+            if not nested:
+                vtimezone[name] = value.strip()
+            continue
+        if event is None or nested:
+            continue
+        if name in ('RRULE', 'RDATE', 'EXDATE', 'EXRULE'):
+            event['RECURRENCE'].append(line)
+        elif name not in event:
+            event[name] = (params, value)
+
+def unescape_ics_text(value):
+    """Unescape an ICS TEXT value."""
+    return re.sub(
+        r'\\([\;,nN])',
+        lambda match: '\n' if match.group(1) in 'nN' else match.group(1),
+        value
+    )
+
+def resolve_ics_timezone(tzid, timezones):
+    """Map an ICS TZID to an IANA zone name, or None if it can't be resolved."""
+    tzid = tzid.strip()
+    if tzid in pytz.all_timezones_set:
+        return tzid
+    if tzid in timezones:
+        return timezones[tzid]
+    if tzid in WINDOWS_TIMEZONES:
+        return WINDOWS_TIMEZONES[tzid]
+    
+    # Some exporters prefix IANA names, e.g. "/mozilla.org/20070129_1/Europe/Berlin"
+    parts = tzid.strip('/').split('/')
+    for index in range(1, len(parts)):
+        candidate = '/'.join(parts[index:])
+        if candidate in pytz.all_timezones_set:
+            return candidate
+    return None
+
+def parse_ics_datetime(params, value, timezones, default_tz):
+    """Parse an ICS date or date-time into (value, timezone name or None).
+    
+    Dates are returned as date objects, date-times as naive datetimes in the returned zone.
+    Floating times use `default_tz`. Raises ValueError if the zone can't be resolved.
+    """
+    value = value.strip()
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return datetime.strptime(value[:8], "%Y%m%d").date(), None
+    
+    if value.endswith('Z'):
+        return datetime.strptime(value[:-1][:15], "%Y%m%dT%H%M%S"), 'UTC'
+    
+    if 'TZID' in params:
+        tzid = resolve_ics_timezone(params['TZID'], timezones)
+    else:
+        tzid = default_tz
+    if tzid is None:
+        raise ValueError(f"Unknown time zone: {params.get('TZID', 'floating time')}")
+    return datetime.strptime(value[:15], "%Y%m%dT%H%M%S"), tzid
+
+def parse_ics_duration(value):
+    """Parse an ICS DURATION value into a timedelta."""
+    match = ICS_DURATION_PATTERN.match(value.strip())
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(
+        weeks=int(weeks or 0),
+        days=int(days or 0),
+        hours=int(hours or 0),
+        minutes=int(minutes or 0),
+        seconds=int(seconds or 0)
+    )
+    return -duration if sign == '-' else duration
+
+def ics_event_to_calendar_body(vevent, timezones, default_tz):
+    """Convert a parsed VEVENT into a Google Calendar event body, or None if unusable.
+    
+    `default_tz` is the target calendar's zone, used for floating times.
+    """
+    if 'DTSTART' not in vevent:
+        return None
+    
+    try:
+        start, tzid = parse_ics_datetime(*vevent['DTSTART'], timezones, default_tz)
+        if 'DTEND' in vevent:
+            end, end_tzid = parse_ics_datetime(*vevent['DTEND'], timezones, default_tz)
+        elif 'DURATION' in vevent and parse_ics_duration(vevent['DURATION'][1]) is not None:
+            end, end_tzid = start + parse_ics_duration(vevent['DURATION'][1]), tzid
+        else:
+            # Per RFC 5545 an event without an end lasts one day (dates) or zero time
+            end, end_tzid = (start + timedelta(days=1) if tzid is None else start), tzid
+    except ValueError:
+        return None
+    
+    if tzid is None:
+        start_field = {'date': start.isoformat()}
+        end_field = {'date': end.isoformat() if end_tzid is None else (start + timedelta(days=1)).isoformat()}
+    else:
+        start_field = {'dateTime': start.isoformat(), 'timeZone': tzid}
+        if end_tzid is None:
+            end, end_tzid = start, tzid
+        end_field = {'dateTime': end.isoformat(), 'timeZone': end_tzid}
+    
+    body = {
+        'summary': unescape_ics_text(vevent.get('SUMMARY', ({}, ''))[1]).strip() or '(No title)',
+        'description': unescape_ics_text(vevent.get('DESCRIPTION', ({}, ''))[1]) or 'Event imported via Telegram bot',
+        'start': start_field,
+        'end': end_field,
+    }
+    if 'LOCATION' in vevent:
+        body['location'] = unescape_ics_text(vevent['LOCATION'][1])
+    if 'RECURRENCE-ID' in vevent:
+        # A moved, changed or cancelled occurrence of a recurring event, applied to its series later
+        try:
+            original, original_tzid = parse_ics_datetime(*vevent['RECURRENCE-ID'], timezones, default_tz)
+        except ValueError:
+            return None
+        if original_tzid is None:
+            body['originalStartTime'] = {'date': original.isoformat()}
+        else:
+            body['originalStartTime'] = {'dateTime': original.isoformat(), 'timeZone': original_tzid}
+        if vevent.get('STATUS', ({}, ''))[1].strip().upper() == 'CANCELLED':
+            body['status'] = 'cancelled'
+    elif vevent['RECURRENCE']:
+        body['recurrence'] = vevent['RECURRENCE']
+    if 'UID' in vevent:
+        body['extendedProperties'] = {'private': {'icsUid': vevent['UID'][1][:1024]}}
+    return body
+
+def calendar_event_key(body):
+    """Build a (title, start) key used to detect duplicate events."""
+    start = body.get('start', {})
+    if 'date' in start:
+        start_key = start['date']
+    else:
+        try:
+            start_dt = date_parser.isoparse(start.get('dateTime', ''))
+        except ValueError:
+            return None
+        if start_dt.tzinfo is None:
+            zone = pytz.timezone(start.get('timeZone') or 'UTC')
+            start_dt = zone.localize(start_dt)
+        start_key = start_dt.astimezone(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+    return (body.get('summary', '').strip().lower(), start_key)
+
+@traced('calendar.events.list')
+def fetch_existing_event_keys(service):
+    """Collect ICS UIDs and (title, start) keys of events already in the calendar."""
+    uids, keys = set(), set()
+    page_token = None
+    while True:
+        response = service.events().list(
+            calendarId=CALENDAR_ID,
+            maxResults=2500,
+            pageToken=page_token,
+            fields='nextPageToken,items(summary,start,extendedProperties/private)'
+        ).execute()
+        for item in response.get('items', []):
+            uid = item.get('extendedProperties', {}).get('private', {}).get('icsUid')
+            if uid:
+                uids.add(uid)
+            key = calendar_event_key(item)
+            if key:
+                keys.add(key)
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return uids, keys
+
+def fetch_calendar_timezone(service):
+    """Return the IANA time zone of the target calendar, or None if unknown."""
+    calendar = service.calendars().get(calendarId=CALENDAR_ID, fields='timeZone').execute()
+    tzid = calendar.get('timeZone')
+    return tzid if tzid in pytz.all_timezones_set else None
+
+def is_rate_limit_error(error):
+    """Check whether a Calendar API error is a quota/rate limit error worth retrying."""
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    return error.resp.status == 403 and b'ratelimitexceeded' in (error.content or b'').lower()
+
+@traced('calendar.events.batch_insert')
+def execute_calendar_batch(service, bodies):
+    """Insert events in a single HTTP batch. Returns (inserted count, failed count, bodies to retry)."""
+    errors = {}
+    
+    def callback(request_id, response, exception):
+        errors[request_id] = exception
+    
+    batch = service.new_batch_http_request(callback=callback)
+    for index, body in enumerate(bodies):
+        batch.add(service.events().insert(calendarId=CALENDAR_ID, body=body), request_id=str(index))
+    batch.execute()
+    
+    inserted, failed, retry = 0, 0, []
+    for index, body in enumerate(bodies):
+        error = errors.get(str(index))
+        if error is None:
+            inserted += 1
+        elif is_rate_limit_error(error):
+            retry.append(body)
+        else:
+            failed += 1
+            logger.warning("Failed to import event '%s': %s", body.get('summary'), error)
+    return inserted, failed, retry
+
+@traced('calendar.events.override')
+def apply_calendar_override(service, master_id, body):
+    """Replace one occurrence of a recurring event with its modified version.
+    
+    `body` is an ICS override with its original start in 'originalStartTime'.
+    Returns False if the series has no occurrence at that time.
+    """
+    body = dict(body)
+    original_start = body.pop('originalStartTime')
+    wanted = calendar_event_key({'start': original_start})
+    if wanted is None:
+        return False
+    
+    if 'date' in original_start:
+        center = pytz.utc.localize(date_parser.isoparse(original_start['date']))
+    else:
+        center = pytz.timezone(original_start['timeZone']).localize(date_parser.isoparse(original_start['dateTime']))
+    response = service.events().instances(
+        calendarId=CALENDAR_ID,
+        eventId=master_id,
+        timeMin=(center - timedelta(days=1)).isoformat(),
+        timeMax=(center + timedelta(days=2)).isoformat(),
+        fields='items(id,originalStartTime)'
+    ).execute()
+    for item in response.get('items', []):
+        if calendar_event_key({'start': item.get('originalStartTime', {})}) == wanted:
+            service.events().patch(calendarId=CALENDAR_ID, eventId=item['id'], body=body).execute()
+            return True
+    return False
+
+async def insert_calendar_batch(service, bodies):
+    """Insert a batch of events, backing off and retrying the rate-limited ones."""
+    inserted, failed = 0, 0
+    for attempt in range(ICS_IMPORT_MAX_RETRIES + 1):
+        batch_inserted, batch_failed, bodies = await asyncio.to_thread(execute_calendar_batch, service, bodies)
+        inserted += batch_inserted
+        failed += batch_failed
+        if not bodies:
+            break
+        if attempt < ICS_IMPORT_MAX_RETRIES:
+            await asyncio.sleep(ICS_IMPORT_BATCH_DELAY * (2 ** attempt))
+    return inserted, failed + len(bodies)
+
+@traced('handle_ics_import')
+async def handle_ics_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Import events from an uploaded .ics file into Google Calendar."""
+    document = update.message.document
+    progress_message = await update.message.reply_text("📥 Importing events from your calendar file...")
+    
+    service = get_google_calendar_service()
+    if not service:
+        await progress_message.edit_text("❌ Google Calendar is not available. Please try again later.")
+        return
+    
+    with tempfile.NamedTemporaryFile(suffix='.ics', delete=False) as ics_file:
+        ics_path = ics_file.name
+    
+    stats = {'imported': 0, 'overrides': 0, 'duplicates': 0, 'skipped': 0, 'failed': 0}
+    try:
+        file = await context.bot.get_file(document.file_id)
+        await file.download_to_drive(ics_path)
+        
+        existing_uids, existing_keys = await asyncio.to_thread(fetch_existing_event_keys, service)
+        calendar_tz = await asyncio.to_thread(fetch_calendar_timezone, service)
+        timezones = {}
+        
+        pending = []
+        overrides = []  # (UID, body) of modified occurrences, applied once their series exists
+        series_ids = {}  # ICS UID -> Calendar event ID of recurring events inserted by this import
+        last_progress = time.monotonic()
+        last_progress_text = None
+        
+        async def flush():
+            inserted, failed = await insert_calendar_batch(service, pending)
+            stats['imported'] += inserted
+            stats['failed'] += failed
+            pending.clear()
+            await asyncio.sleep(ICS_IMPORT_BATCH_DELAY)
+        
+        for count, vevent in enumerate(iter_ics_events(ics_path, timezones), start=1):
+            if count % ICS_IMPORT_YIELD_EVERY == 0:
+                # Parsing runs on the event loop; let other chats' updates through
+                await asyncio.sleep(0)
+            
+            body = ics_event_to_calendar_body(vevent, timezones, calendar_tz)
+            if body is None:
+                stats['skipped'] += 1
+                continue
+            
+            uid = body.get('extendedProperties', {}).get('private', {}).get('icsUid')
+            if 'originalStartTime' in body:
+                # Overrides share their series' UID and may come before it in the file
+                overrides.append((uid, body))
+                continue
+            key = calendar_event_key(body)
+            if (uid and uid in existing_uids) or (key and key in existing_keys):
+                stats['duplicates'] += 1
+                continue
+            if uid:
+                existing_uids.add(uid)
+                if 'recurrence' in body:
+                    body['id'] = series_ids[uid] = new_idempotency_key()
+            if key:
+                existing_keys.add(key)
+            
+            pending.append(body)
+            if len(pending) >= ICS_IMPORT_BATCH_SIZE:
+                await flush()
+                if time.monotonic() - last_progress >= ICS_IMPORT_PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    progress_text = (
+                        f"📥 Importing events... {stats['imported']} imported, "
+                        f"{stats['duplicates']} duplicates skipped, {stats['failed']} failed so far."
+                    )
+                    if progress_text != last_progress_text:
+                        last_progress_text = progress_text
+                        try:
+                            await progress_message.edit_text(progress_text)
+                        except Exception as e:
+                            # Progress is cosmetic; never let it end the import
+                            logger.warning("Could not update ICS import progress: %s", e)
+        
+        for uid, body in overrides:
+            if uid in series_ids:
+                if pending:
+                    await flush()  # The series must exist before its occurrences can be changed
+                try:
+                    applied = await asyncio.to_thread(apply_calendar_override, service, series_ids[uid], body)
+                except Exception as e:
+                    logger.warning("Failed to apply changed occurrence of '%s': %s", body.get('summary'), e)
+                    applied = False
+                if applied:
+                    stats['overrides'] += 1
+                else:
+                    stats['failed'] += 1
+            elif uid and uid in existing_uids:
+                stats['duplicates'] += 1  # Its series was already in the calendar
+            elif body.get('status') != 'cancelled':
+                # No series to attach to, so keep the occurrence as a standalone event
+                body = {name: value for name, value in body.items() if name != 'originalStartTime'}
+                key = calendar_event_key(body)
+                if key and key in existing_keys:
+                    stats['duplicates'] += 1
+                    continue
+                if key:
+                    existing_keys.add(key)
+                pending.append(body)
+                if len(pending) >= ICS_IMPORT_BATCH_SIZE:
+                    await flush()
+        
+        if pending:
+            await flush()
+        
+        await progress_message.edit_text(
+            f"✅ Calendar import finished!\n\n"
+            f"📅 Imported: {stats['imported']}\n"
+            f"✏️ Changed occurrences of recurring events: {stats['overrides']}\n"
+            f"🔁 Duplicates skipped: {stats['duplicates']}\n"
+            f"⚠️ Unreadable entries (including unknown time zones): {stats['skipped']}\n"
+            f"❌ Failed: {stats['failed']}"
+        )
+        logger.info("ICS import finished: %s", stats)
+        
+    except Exception as e:
+        logger.error("Error importing ICS file: %s", e)
+        await progress_message.edit_text(
+            f"❌ Error importing calendar file: {str(e)}\n"
+            f"Imported {stats['imported']} events before the error."
+        )
+    finally:
+        os.unlink(ics_path)
+
+# Transcript search handlers
+def format_search_results(search_id, query, rows):
+    """Build the text and pagination keyboard for a page of search results."""
+    if not rows:
+        return f"🔎 No more voice notes matching \"{query}\".", None
+    
+    lines = [f"🔎 Voice notes matching \"{query}\":\n"]
+    for _, created_at, duration, snippet in rows:
+        when = datetime.fromtimestamp(created_at, pytz.utc).strftime('%Y-%m-%d %H:%M')
+        length = f" · {duration // 60}:{duration % 60:02d}" if duration else ""
+        lines.append(f"🗓 {when} UTC{length}\n{snippet}\n")
+    
+    reply_markup = None
+    if len(rows) == SEARCH_PAGE_SIZE:
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("Older ▶", callback_data=f"search:{search_id}:{rows[-1][0]}")]])
+    return '\n'.join(lines), reply_markup
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Search this chat's voice note transcripts."""
+    query = ' '.join(context.args)
+    if not query:
+        await update.message.reply_text("Usage: /search <words>\nExample: /search dentist appointment")
+        return
+    
+    with trace_span('transcripts.search'):
+        rows = transcripts.search(update.effective_chat.id, query)
+    # The query is stored under an ID carried by the buttons, so each result message pages its own search
+    search_id = transcripts.save_search(update.effective_chat.id, query)
+    text, reply_markup = format_search_results(search_id, query, rows)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the next page of search results."""
+    callback_query = update.callback_query
+    await callback_query.answer()
+    
+    _, search_id, before_id = callback_query.data.split(':')
+    query = transcripts.get_search(update.effective_chat.id, int(search_id))
+    if not query:
+        await callback_query.edit_message_text("This search has expired. Please run /search again.")
+        return
+    
+    with trace_span('transcripts.search'):
+        rows = transcripts.search(update.effective_chat.id, query, int(before_id))
+    text, reply_markup = format_search_results(int(search_id), query, rows)
+    await callback_query.edit_message_text(text, reply_markup=reply_markup)
+
+async def prune_transcripts(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job deleting transcripts older than the retention period, and expired searches."""
+    transcripts.prune_searches(time.time() - SEARCH_RETENTION)
+    cutoff = time.time() - TRANSCRIPT_RETENTION_DAYS * 24 * 60 * 60
+    deleted = 0
+    while True:
+        batch_deleted = transcripts.prune_batch(cutoff)
+        deleted += batch_deleted
+        if batch_deleted < TRANSCRIPT_PRUNE_BATCH:
+            break
+        await asyncio.sleep(0)  # Let other updates run between batches
+    if deleted:
+        logger.info("Pruned %s transcripts older than %s days", deleted, TRANSCRIPT_RETENTION_DAYS)
+
+async def prune_outbox(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job deleting finished outbox writes older than the retention period."""
+    cutoff = time.time() - OUTBOX_RETENTION_DAYS * 24 * 60 * 60
+    deleted = 0
+    while True:
+        batch_deleted = outbox.prune_batch(cutoff)
+        deleted += batch_deleted
+        if batch_deleted < OUTBOX_PRUNE_BATCH:
+            break
+        await asyncio.sleep(0)  # Let other updates run between batches
+    if deleted:
+        logger.info("Pruned %s finished outbox writes older than %s days", deleted, OUTBOX_RETENTION_DAYS)
+
+# State management handlers
+def evict_user_state(application):
+    """Drop the stored data of users and chats that are idle or over capacity."""
+    for kind, key_id in user_state.pop_expired():
+        if kind == 'user':
+            application.drop_user_data(key_id)
+        else:
+            application.drop_chat_data(key_id)
+
+async def touch_user_state(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Record activity of the update's user and chat."""
+    if update.effective_user:
+        user_state.touch(('user', update.effective_user.id))
+    if update.effective_chat:
+        user_state.touch(('chat', update.effective_chat.id))
+    if len(user_state) > user_state.max_entries:
+        evict_user_state(context.application)
+
+async def sweep_user_state(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job evicting state of users and chats idle past the TTL."""
+    evict_user_state(context.application)
+
+def estimate_size(obj, seen=None):
+    """Approximate the memory used by an object and everything it references."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(key, seen) + estimate_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += estimate_size(vars(obj), seen)
+    return size
+
+# Update processing
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats concurrently and each chat's updates in order.
+    
+    While a chat has an update in progress, later updates for that chat are queued
+    behind it and run by the same task, so waiting updates don't take up concurrency
+    slots and ConversationHandler steps of one chat never race each other.
+    """
+    
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self.chat_queues = {}
+    
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+        
+        pending = self.chat_queues.get(chat.id)
+        if pending is not None:
+            # The task already processing this chat will run it next
+            pending.append(coroutine)
+            return
+        
+        pending = self.chat_queues[chat.id] = collections.deque([coroutine])
+        try:
+            while pending:
+                try:
+                    await pending[0]
+                except Exception as e:
+                    logger.error("Error processing update for chat %s: %s", chat.id, e)
+                finally:
+                    pending.popleft()
+        finally:
+            del self.chat_queues[chat.id]
+            for leftover in pending:
+                leftover.close()
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+# Logging handlers
+async def report_log_losses(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job logging how many records were rate-limited or dropped since the last report."""
+    rate_filter = log_queue_handler.filters[0]
+    suppressed, rate_filter.suppressed = rate_filter.suppressed, 0
+    dropped, log_queue_handler.dropped = log_queue_handler.dropped, 0
+    spans_dropped, trace_queue_handler.dropped = trace_queue_handler.dropped, 0
+    if suppressed or dropped or spans_dropped:
+        logger.warning(
+            "In the last %ss: %s log records rate-limited, %s log records and %s spans dropped (queue full)",
+            LOG_LOSS_REPORT_INTERVAL, suppressed, dropped, spans_dropped
+        )
+
+# Tracing and profiling handlers
+async def start_update_trace(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Assign a trace ID to each incoming update."""
+    trace_id_var.set(f"{update.update_id}-{secrets.token_hex(4)}")
+    span_id_var.set(None)
+
+def thread_cpu_time(thread_id):
+    """Return the CPU seconds used by a thread, or None where per-thread clocks aren't available."""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError):
+        return None
+
+def sample_stacks(duration, interval):
+    """Profile the CPU use of the bot's threads for `duration` seconds.
+    
+    Returns (Counter of collapsed stacks "thread;outer;...;inner", unit). Where the
+    platform has per-thread CPU clocks, each stack is weighted by the CPU microseconds
+    its thread used since the previous sample, so blocked threads add nothing.
+    Otherwise stacks are counted per sample, skipping threads parked in a known wait.
+    The sampler and logging listener threads are left out.
+    """
+    counts = collections.Counter()
+    last_cpu = {}
+    unit = 'cpu_us' if thread_cpu_time(threading.get_ident()) is not None else 'samples'
+    skipped_ids = {threading.get_ident()} | {
+        listener._thread.ident for listener in (log_listener, trace_listener) if listener._thread
+    }
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in skipped_ids:
+                continue
+            
+            if unit == 'cpu_us':
+                cpu = thread_cpu_time(thread_id)
+                if cpu is None:
+                    continue
+                weight = round((cpu - last_cpu.get(thread_id, cpu)) * 1_000_000)
+                last_cpu[thread_id] = cpu
+            else:
+                leaf = frame.f_code
+                weight = 0 if (os.path.basename(leaf.co_filename), leaf.co_name) in PROFILE_WAIT_FRAMES else 1
+            if weight <= 0:
+                continue
+            
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, str(thread_id)))
+            counts[';'.join(reversed(stack))] += weight
+        time.sleep(interval)
+    return counts, unit
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Profile the running bot for N seconds and send a collapsed-stack dump (admins only)."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ This command is only available to administrators.")
+        return
+    
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("Usage: /profile [seconds]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    
+    if profiler_lock.locked():
+        await update.message.reply_text("A profiling session is already running.")
+        return
+    
+    async with profiler_lock:
+        await update.message.reply_text(f"🔬 Profiling for {seconds} seconds...")
+        counts, unit = await asyncio.to_thread(sample_stacks, seconds, PROFILE_INTERVAL)
+    
+    dump = '\n'.join(f"{stack} {count}" for stack, count in counts.most_common())
+    await update.message.reply_document(
+        document=io.BytesIO(dump.encode('utf-8')),
+        filename=f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded",
+        caption=(
+            f"{sum(counts.values()) / 1000:.1f} ms of CPU time sampled" if unit == 'cpu_us'
+            else f"{sum(counts.values())} samples"
+        ) + ". Open with speedscope or flamegraph.pl."
+    )
+    logger.info("Profile of %ss sent to user %s", seconds, update.effective_user.id)
+
+def schedule_event_reminder(chat_id, title, event_start):
+    """Schedule a reminder before an event. Naive start times are treated as UTC."""
+    if event_start.tzinfo is None:
+        event_start = event_start.replace(tzinfo=pytz.utc)
+    start_ts = event_start.timestamp()
+    if start_ts <= time.time():
+        return False
+    
+    fire_at = max(start_ts - REMINDER_LEAD_MINUTES * 60, time.time())
+    reminders.schedule(
+        chat_id,
+        fire_at,
+        f"⏰ Reminder: {title} starts at {event_start.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M')} UTC",
+        event_start=start_ts
+    )
+    return True
+
+async def on_startup(application: Application):
+    """Start background services once the bot is initialized."""
+    await reminders.start(application.bot)
+    await outbox.start(application.bot)
+
+async def on_shutdown(application: Application):
+    """Stop background services."""
+    await outbox.stop()
+    await reminders.stop()
+
 def check_environment_variables():
     """Check if all required environment variables are set"""
     required_vars = {
@@ -813,6 +2671,8 @@ def main():
             from download_vosk import download_vosk_model
             model_path = download_vosk_model()
             logger.info(f"Vosk model path: {model_path}")
+            # Load the model up front so the first voice reply is fast
+            get_vosk_model()
         except Exception as e:
             logger.warning(f"Could not download Vosk model: {str(e)}")
             logger.warning("Voice note transcription will not be available.")
@@ -823,19 +2683,34 @@ def main():
             raise ValueError("TELEGRAM_TOKEN not found in environment variables")
         
         # Initialize bot with proper configuration
-        application = Application.builder().token(token).build()
+        application = (
+            Application.builder()
+            .token(token)
+            .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+            .post_init(on_startup)
+            .post_shutdown(on_shutdown)
+            .build()
+        )
         
         # Add conversation handler for task creation
         task_conv_handler = ConversationHandler(
             entry_points=[CommandHandler('task', task_command)],
             states={
                 TASK_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_name_handler)],
-                TASK_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_date_handler)],
+                TASK_DATE: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, task_date_handler),
+                    MessageHandler(filters.VOICE, voice_step_handler('date', task_date_handler, TASK_DATE)),
+                ],
                 TASK_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_time_handler)],
-                TASK_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_duration_handler)],
+                TASK_DURATION: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, task_duration_handler),
+                    MessageHandler(filters.VOICE, voice_step_handler('duration', task_duration_handler, TASK_DURATION)),
+                ],
                 TASK_ATTENDEES: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_attendees_handler)],
+                ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout_handler)],
             },
-            fallbacks=[],
+            fallbacks=[CommandHandler('cancel', cancel_command)],
+            conversation_timeout=CONVERSATION_TIMEOUT,
         )
         
         # Add conversation handler for calendar event creation
@@ -843,18 +2718,35 @@ def main():
             entry_points=[CommandHandler('calendar', calendar_command)],
             states={
                 EVENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, event_name_handler)],
-                EVENT_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, event_date_handler)],
-                EVENT_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, event_time_handler)],
-                EVENT_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, event_duration_handler)],
+                EVENT_DATE: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, event_date_handler),
+                    MessageHandler(filters.VOICE, voice_step_handler('date', event_date_handler, EVENT_DATE)),
+                ],
+                EVENT_TIME: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, event_time_handler),
+                    MessageHandler(filters.VOICE, voice_step_handler('time', event_time_handler, EVENT_TIME)),
+                ],
+                EVENT_DURATION: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, event_duration_handler),
+                    MessageHandler(filters.VOICE, voice_step_handler('duration', event_duration_handler, EVENT_DURATION)),
+                ],
                 EVENT_ATTENDEES: [MessageHandler(filters.TEXT & ~filters.COMMAND, event_attendees_handler)],
+                ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout_handler)],
             },
-            fallbacks=[],
+            fallbacks=[CommandHandler('cancel', cancel_command)],
+            conversation_timeout=CONVERSATION_TIMEOUT,
         )
         
         # Add handlers
+        application.add_handler(TypeHandler(Update, touch_user_state), group=-2)
+        application.add_handler(TypeHandler(Update, start_update_trace), group=-1)
         application.add_handler(CommandHandler("start", start))
         application.add_handler(CommandHandler("help", help_command))
         application.add_handler(CommandHandler("status", status_command))
+        application.add_handler(CommandHandler("search", search_command))
+        application.add_handler(CallbackQueryHandler(search_page_callback, pattern=r'^search:\d+:\d+$'))
+        # Non-blocking so other updates keep flowing while the profiler samples them
+        application.add_handler(CommandHandler("profile", profile_command, block=False))
         application.add_handler(task_conv_handler)
         application.add_handler(calendar_conv_handler)
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -862,6 +2754,25 @@ def main():
         # Add voice note handler
         application.add_handler(MessageHandler(filters.VOICE, handle_voice_note))
         
+        # Add calendar file import handler, non-blocking so a long import doesn't hold up the chat's later updates
+        application.add_handler(MessageHandler(
+            filters.Document.FileExtension("ics") | filters.Document.MimeType("text/calendar"),
+            handle_ics_import,
+            block=False
+        ))
+        
+        # Periodically report log records lost to rate limiting or a full queue
+        application.job_queue.run_repeating(report_log_losses, interval=LOG_LOSS_REPORT_INTERVAL)
+        
+        # Periodically evict state of idle users and chats
+        application.job_queue.run_repeating(sweep_user_state, interval=STATE_SWEEP_INTERVAL)
+        
+        # Periodically delete transcripts past their retention period
+        application.job_queue.run_repeating(prune_transcripts, interval=TRANSCRIPT_PRUNE_INTERVAL, first=60)
+        
+        # Periodically delete finished outbox writes
+        application.job_queue.run_repeating(prune_outbox, interval=OUTBOX_PRUNE_INTERVAL, first=90)
+        
         # Start the bot
         logger.info("Starting bot...")
         application.run_polling(allowed_updates=Update.ALL_TYPES)